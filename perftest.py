@@ -1,4 +1,5 @@
 import resource
+import tracemalloc
 from time import clock
 
 from sortedsets import SortedSet
@@ -26,6 +27,23 @@ def test(size):
     print("Insertion speed", format(ins_time, '10.2f'), "ins/s")
     print("Deletion speed ", format(del_time, '10.2f'), "del/s")
 
+def test_memory(size, small_size, num=1000):
+    keys = [['user{}:{}'.format(j, i) for i in range(size)]
+            for j in range(num)]
+    old_size = SortedSet.small_size
+    SortedSet.small_size = small_size
+    tracemalloc.start()
+    sets = [SortedSet((k, i) for i, k in enumerate(ks)) for ks in keys]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    SortedSet.small_size = old_size
+    return used // num
+
+for size in (5, 20, 50, 100):
+    print("SORTED SET WITH", size, "ELEMENTS")
+    print("Skiplist memory", format(test_memory(size, 0), '10d'), "bytes")
+    print("Small memory   ", format(test_memory(size, size), '10d'), "bytes")
+
 for size in (10000, 100000, 1000000, 10000000):
     test(size)
 
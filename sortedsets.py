@@ -1,11 +1,28 @@
+import os
+import mmap
 import random
+import struct
 import reprlib
-from collections import namedtuple, MutableMapping
-from itertools import islice
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, Mapping, MutableMapping
+from itertools import islice, accumulate
+from operator import itemgetter
 
 
 empty = object()
 
+# A record of a single change of the set, ``op`` is either ``set`` or ``del``
+# (``score`` is None for the latter)
+Change = namedtuple('Change', 'seq op key score')
+
+
+class SequenceGap(ValueError):
+    """Changes don't continue the sequence of the replica set
+
+    Replica should be synced again from a fresh snapshot of the source set.
+    """
+
 
 class Pointer:
     __slots__ = ('forward', 'span')
@@ -81,6 +98,10 @@ class RankView:
                 raise ValueError("Negative step is useless")
             if stop <= start:
                 return self._set.__class__()  # empty set
+            if self._set._header is None:
+                return self._set._from_sorted(
+                    self._set._keys[start:stop:step],
+                    self._set._scores[start:stop:step])
 
             startitem = self._set._item_by_index(start)
             stop -= start
@@ -88,29 +109,58 @@ class RankView:
             return self._set._from_items(
                 islice(startitem._iter_to(None), 0, stop, step))
         else:
+            if self._set._header is None:
+                if key < 0 or key >= len(self._set):
+                    raise IndexError(key)
+                return self._set._keys[key]
             item = self._set._item_by_index(key)
             return item.key
 
     def __delitem__(self, key):
         if isinstance(key, slice):
-            set_len = len(self._set)
-            start, stop, step = key.indices(set_len)
-
-            if step != 1:
+            if key.step is not None and key.step != 1:
                 raise ValueError("Step is not suported for item deletion")
-            if stop <= start:
-                return  # nothing to delete
-
-            next, update = self._set._item_and_pointers_by_index(start)
-            stop -= start
-            for i in range(stop):
-                item = next
-                next = item[0].forward
-                del self._set._mapping[item.key]
-                self._set._delete_node(item, update)
+            self.remove(key.start, key.stop)
         else:
-            item, update = self._set._item_and_pointers_by_index(key)
+            if self._set._header is None:
+                if key < 0 or key >= len(self._set):
+                    raise IndexError(key)
+                self._set._cut(key, key + 1)
+                return
+            item, update, _ = self._set._item_and_pointers_by_index(key)
+            if item is None:
+                raise IndexError(key)
+            del self._set._mapping[item.key]
             self._set._delete_node(item, update)
+            self._set._maybe_to_small()
+            self._set._changed('del', item.key)
+
+    def remove(self, start=None, stop=None):
+        """Removes items ranked from ``start`` to ``stop``
+
+        Same as ``del ss.by_index[start:stop]`` but returns number of
+        removed items
+        """
+        return self._remove(start, stop, False)
+
+    def pop(self, start=None, stop=None):
+        """Removes items ranked from ``start`` to ``stop`` and returns them
+
+        Removed items are returned as a new set without copying them
+        """
+        return self._remove(start, stop, True)
+
+    def _remove(self, start, stop, detach):
+        start, stop, _ = slice(start, stop).indices(len(self._set))
+        if self._set._header is None:
+            return self._set._cut(start, stop, detach)
+        _, before, before_rank = self._set._item_and_pointers_by_index(start)
+        if stop <= start:
+            last, last_rank = before, before_rank
+        else:
+            _, last, last_rank = self._set._item_and_pointers_by_index(stop)
+        return self._set._unlink_range(before, before_rank, last, last_rank,
+                                       detach)
 
 
 class ScoreView:
@@ -126,6 +176,10 @@ class ScoreView:
             if(key.start is not None and key.stop is not None and
                key.start >= key.stop) or not len(self._set):
                 return self._set.__class__()
+            if self._set._header is None:
+                start, stop = self._set._small_bounds(key.start, key.stop)
+                return self._set._from_sorted(self._set._keys[start:stop],
+                                              self._set._scores[start:stop])
 
             startitem = self._set._header[0].forward
             if key.start is not None:
@@ -151,33 +205,44 @@ class ScoreView:
         if isinstance(key, slice):
             if key.step != None:
                 raise ValueError("Step must be None")
-            if(key.start is not None and key.stop is not None and
-               key.start >= key.stop) or not len(self._set):
-                return  # nothing to delete
-
-            if key.start is None:
-                key.start = self._set._header[0].forward.score
-            next, update = self._set._item_and_pointers_by_score_left_incl(
-                key.start)
-            if next is None:
-                # means key.start is greater than max score in set
-                return  # nothing to delete
-
-            if key.stop:
-                while next and next.score <= key.stop:
-                    item = next
-                    next = item[0].forward
-                    del self._set._mapping[item.key]
-                    self._set._delete_node(item, update)
-            else:
-                while next:
-                    item = next
-                    next = item[0].forward
-                    del self._set._mapping[item.key]
-                    self._set._delete_node(item, update)
+            self.remove(key.start, key.stop)
         else:
             raise NotImplementedError('Only slicing by score supported')
 
+    def remove(self, start=None, stop=None):
+        """Removes items scored from ``start`` inclusive to ``stop`` exclusive
+
+        Same as ``del ss.by_score[start:stop]`` but returns number of
+        removed items
+        """
+        return self._remove(start, stop, False)
+
+    def pop(self, start=None, stop=None):
+        """Removes items scored from ``start`` to ``stop`` and returns them
+
+        Removed items are returned as a new set without copying them
+        """
+        return self._remove(start, stop, True)
+
+    def _remove(self, start, stop, detach):
+        if self._set._header is None:
+            return self._set._cut(*self._set._small_bounds(start, stop),
+                                  detach=detach)
+        if start is None:
+            _, before, before_rank = self._set._item_and_pointers_by_index(0)
+        else:
+            _, before, before_rank = (
+                self._set._item_and_pointers_by_score_left_incl(start))
+        if start is not None and stop is not None and start >= stop:
+            last, last_rank = before, before_rank
+        elif stop is None:
+            last, last_rank = self._set._tail_pointers()
+        else:
+            _, last, last_rank = (
+                self._set._item_and_pointers_by_score_left_incl(stop))
+        return self._set._unlink_range(before, before_rank, last, last_rank,
+                                       detach)
+
 
 def _random_level():
     """Returns a random level for the new skiplist node
@@ -193,19 +258,134 @@ def _random_level():
 
 
 class SortedSet(MutableMapping):
-    __slots__ = ('_level', '_mapping', '_header', '_tail',
-                 'by_score', 'by_index')
+    __slots__ = ('_level', '_mapping', '_header', '_tail', '_last',
+                 '_keys', '_scores', '_seq', '_listeners', '_weights')
+
+    # Sets of up to this number of items are kept as plain sorted lists,
+    # like listpack encoding in redis. Skiplist is converted back when set
+    # shrinks to half of this size.
+    small_size = 128
 
     def __init__(self, source=None):
+        # Small sets have ``_keys`` and ``_scores`` lists in sort order, and
+        # ``_mapping`` of key to score, but no skiplist (``_header`` is None)
         self._level = 1
         self._mapping = {}
-        self._header = Item(empty, empty)
+        self._keys = []
+        self._scores = []
+        self._header = None
         self._tail = None
-        self.by_index = RankView(self)
-        self.by_score = ScoreView(self)
+        self._last = None
+        self._seq = 0  # sequence number of the last change
+        self._listeners = None
+        self._weights = None  # sequence and prefix sums of scores
         if source is not None:
             self.update(source)
 
+    @property
+    def by_index(self):
+        return RankView(self)
+
+    @property
+    def by_score(self):
+        return ScoreView(self)
+
+    def _to_skiplist(self):
+        keys = self._keys
+        scores = self._scores
+        self._keys = self._scores = None
+        self._level = 1
+        self._mapping = {}
+        self._header = Item(empty, empty)
+        # span of the last pointer at each level reaches past the end of the
+        # list, i.e. it's ``len(self) + 1`` for the header of an empty set
+        self._header.pointers.append(Pointer(None, 1))
+        self._tail = None
+        # rightmost node at each level, the update vector for appending
+        self._last = [self._header]
+        for key, score in zip(keys, scores):
+            self._insert(key, score)  # always appends, so it's O(n) total
+
+    def _to_small(self):
+        keys = []
+        scores = []
+        item = self._header.pointers[0].forward
+        while item is not None:
+            keys.append(item.key)
+            scores.append(item.score)
+            item.backward = None  # let refcounting free the skiplist
+            item = item.pointers[0].forward
+        self._level = 1
+        self._mapping = dict(zip(keys, scores))
+        self._keys = keys
+        self._scores = scores
+        self._header = self._tail = self._last = None
+
+    def _maybe_to_small(self):
+        if len(self._mapping) < self.small_size // 2:
+            self._to_small()
+
+    @classmethod
+    def _from_sorted(cls, keys, scores):
+        """Generates a new set from lists of keys and scores in sort order"""
+        self = cls()
+        if len(keys) <= self.small_size:
+            self._mapping = dict(zip(keys, scores))
+            self._keys = keys
+            self._scores = scores
+        else:
+            for key, score in zip(keys, scores):
+                self._insert(key, score)
+        return self
+
+    def _small_index(self, key):
+        score = self._mapping[key]
+        scores = self._scores
+        start = bisect_left(scores, score)
+        return self._keys.index(key, start, bisect_right(scores, score, start))
+
+    def _small_bounds(self, start, stop):
+        """Returns indexes of items scored from ``start`` to ``stop``"""
+        scores = self._scores
+        return (0 if start is None else bisect_left(scores, start),
+                len(scores) if stop is None else bisect_left(scores, stop))
+
+    def _small_insert(self, key, score):
+        keys = self._keys
+        scores = self._scores
+        if key in self._mapping:
+            idx = self._small_index(key)
+            del keys[idx]
+            del scores[idx]
+        self._mapping[key] = score
+        idx = bisect_left(scores, score)
+        end = bisect_right(scores, score, idx)
+        if idx < end:
+            # same order of equal scores as in skiplist
+            key_hash = hash(key)
+            while idx < end and hash(keys[idx]) < key_hash:
+                idx += 1
+        keys.insert(idx, key)
+        scores.insert(idx, score)
+
+    def _cut(self, start, stop, detach=False):
+        """Removes items from ``start`` to ``stop`` index of a small set
+
+        Returns number of removed items, or a new set of them if ``detach``
+        is true
+        """
+        keys = self._keys[start:stop]
+        scores = self._scores[start:stop]
+        del self._keys[start:stop]
+        del self._scores[start:stop]
+        mapping = self._mapping
+        for key in keys:
+            del mapping[key]
+        self._changed_many('del', keys)
+        if detach:
+            return self._from_sorted(keys, scores)
+        return len(keys)
+
     @classmethod
     def _from_items(cls, items):
         """Generates a new set from iterator over Item objects
@@ -214,16 +394,145 @@ class SortedSet(MutableMapping):
         """
         self = cls()
         for item in items:
-            self[item.key] = item.score
+            self._insert(item.key, item.score)
         return self
 
+    def copy(self):
+        """Returns a shallow copy of the set
+
+        Skiplist is copied with the same levels and spans of items, so it's
+        O(n) instead of inserting every item again.
+        """
+        result = self.__class__()
+        result._seq = self._seq
+        if self._header is None:
+            result._mapping = self._mapping.copy()
+            result._keys = self._keys[:]
+            result._scores = self._scores[:]
+            return result
+        result._to_skiplist()
+        header = result._header
+        header.pointers = [Pointer(None, ptr.span)
+                           for ptr in self._header.pointers[:self._level]]
+        last = [header] * self._level  # last copied item at each level
+        mapping = result._mapping
+        prev = None
+        item = self._header.pointers[0].forward
+        while item is not None:
+            new = Item(item.key, item.score)
+            new.backward = prev
+            new.pointers = [Pointer(None, ptr.span) for ptr in item.pointers]
+            for i in range(len(new.pointers)):
+                last[i].pointers[i].forward = new
+                last[i] = new
+            mapping[new.key] = new
+            prev = new
+            item = item.pointers[0].forward
+        result._level = self._level
+        result._last = last
+        result._tail = prev
+        return result
+
+    # Point-in-time copy, writes to the original set don't affect it. It has
+    # the same ``sequence``, so it may be used as a replica of the set.
+    snapshot = copy
+    __copy__ = copy
+
+    @property
+    def sequence(self):
+        """Sequence number of the last change of the set
+
+        Set it when making a replica from a snapshot that was transferred
+        without the set itself (e.g. as a list of items).
+        """
+        return self._seq
+
+    @sequence.setter
+    def sequence(self, value):
+        self._seq = value
+        self._weights = None
+
+    def subscribe(self, callback):
+        """Calls ``callback(change)`` with a ``Change`` after every change
+
+        Range deletions report every removed key separately.
+        """
+        if self._listeners is None:
+            self._listeners = []
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        self._listeners.remove(callback)
+        if not self._listeners:
+            self._listeners = None
+
+    def _changed(self, op, key, score=None):
+        self._seq += 1
+        if self._listeners:
+            self._notify(Change(self._seq, op, key, score))
+
+    def _changed_many(self, op, keys):
+        if self._listeners:
+            for key in keys:
+                self._changed(op, key)
+        else:
+            self._seq += len(keys)
+
+    def _notify(self, change):
+        self._seq = change.seq
+        for callback in self._listeners or ():
+            callback(change)
+
+    def apply_changes(self, changes):
+        """Applies changes of another set reported by ``subscribe()``
+
+        Changes that are already applied are skipped. Changes that don't
+        continue ``sequence`` of this set raise ``SequenceGap``, everything
+        up to the gap is applied anyway. Consecutive ``set`` changes are
+        inserted in batches ordered by score.
+
+        Subscribers of this set receive the same changes, so replicas may be
+        chained.
+        """
+        seq = self._seq
+        batch = []
+        for change in changes:
+            if change.seq <= seq:
+                continue
+            if change.seq != seq + 1:
+                self._apply_batch(batch)
+                raise SequenceGap("Expected change {}, got {}"
+                                  .format(seq + 1, change.seq))
+            seq = change.seq
+            if change.op == 'set':
+                batch.append(change)
+            else:
+                self._apply_batch(batch)
+                batch = []
+                self._delete(change.key)
+                self._notify(change)
+        self._apply_batch(batch)
+
+    def _apply_batch(self, batch):
+        latest = {}
+        for change in batch:
+            latest[change.key] = change.score
+        for key, score in sorted(latest.items(), key=itemgetter(1)):
+            self._insert(key, score)
+        for change in batch:
+            self._notify(change)
+
     def __iter__(self):
+        if self._header is None:
+            return iter(self._keys)
         start = self._header[0].forward  # header is always empty
         if not start:
             return iter(())
         return (item.key for item in start._iter_to(None))
 
     def __reversed__(self):
+        if self._header is None:
+            return reversed(self._keys)
         start = self._tail
         if not start:
             return iter(())
@@ -234,94 +543,260 @@ class SortedSet(MutableMapping):
 
 
     def __setitem__(self, key, score):
-        if key in self:
-            del self[key]
+        self._insert(key, score)
+        self._changed('set', key, score)
+
+    def _insert(self, key, score):
+        if self._header is None:
+            if key in self._mapping or len(self._mapping) < self.small_size:
+                self._small_insert(key, score)
+                return
+            self._to_skiplist()
+        mapping = self._mapping
+        if key in mapping:
+            self._delete_item(mapping.pop(key))
             # TODO probably optimize changing a value
         item = Item(key, score)
-        self._mapping[key] = item
-
-        rank = [None] * self._level
-        update = [None] * self._level
-        x = self._header
-        for i in range(self._level-1, -1, -1):
-            # store rank that is crossed to reach the insert position
-            rank[i] = 0 if i == self._level-1 else rank[i+1]
-            while x[i].forward and x[i].forward < item:
-                rank[i] += x[i].span
-                x = x[i].forward
-            update[i] = x
-
-        level = _random_level()
-        if level > self._level:
-            for i in range(self._level, level):
-                assert len(rank) == i
+        key_hash = hash(key)
+
+        level = self._level
+        tail = self._tail
+        if tail is None or tail.score < score or (
+                tail.score == score and hash(tail.key) < key_hash):
+            # appending (e.g. timestamp-ordered scores), no descent needed
+            update, rank = self._tail_pointers()
+            traversed = rank[0]
+        else:
+            # The descent is the hot loop of the whole structure, so it
+            # avoids ``Item.__getitem__`` and ``Item.__lt__``
+            rank = [0] * level
+            update = [None] * level
+            traversed = 0  # rank that is crossed to reach the insert position
+            x = self._header
+            for i in range(level-1, -1, -1):
+                ptr = x.pointers[i]
+                next = ptr.forward
+                while next is not None and (next.score < score or
+                        next.score == score and hash(next.key) < key_hash):
+                    traversed += ptr.span
+                    x = next
+                    ptr = x.pointers[i]
+                    next = ptr.forward
+                rank[i] = traversed
+                update[i] = x
+        mapping[key] = item
+
+        new_level = _random_level()
+        if new_level > level:
+            header = self._header
+            for i in range(level, new_level):
                 rank.append(0)
-                assert len(update) == i
-                update.append(self._header)
-                update[i][i].span = len(self)
-            self._level = level
-
-        x = item
-        for i in range(level):
-            x[i].forward = update[i][i].forward
-            update[i][i].forward = x
-
-            # update span covered by update[i] as x is inserted here
-            x[i].span = update[i][i].span - (rank[0] - rank[i])
-            update[i][i].span = (rank[0] - rank[i]) + 1
+                update.append(header)
+                self._last.append(header)
+                header[i].span = len(mapping)
+            self._level = new_level
+
+        pointers = item.pointers
+        for i in range(new_level):
+            ptr = update[i].pointers[i]
+            # update span covered by update[i] as item is inserted here
+            pointers.append(Pointer(ptr.forward,
+                                    ptr.span - (traversed - rank[i])))
+            ptr.forward = item
+            ptr.span = (traversed - rank[i]) + 1
+            if pointers[i].forward is None:
+                self._last[i] = item
 
         # increment span for untouched levels
-        for i in range(level, self._level):
-            update[i][i].span += 1
-
-        x.backward = None if update[0] == self._header else update[0]
-        if x[0].forward:
-            x[0].forward.backward = x
+        for i in range(new_level, level):
+            update[i].pointers[i].span += 1
+
+        prev = update[0]
+        item.backward = None if prev is self._header else prev
+        next = pointers[0].forward
+        if next is not None:
+            next.backward = item
         else:
-            self._tail = x
+            self._tail = item
 
     def __getitem__(self, key):
+        if self._header is None:
+            return self._mapping[key]
         return self._mapping[key].score
 
     def __delitem__(self, key):
-        item = self._mapping.pop(key)
+        self._delete(key)
+        self._changed('del', key)
+
+    def _delete(self, key):
+        if self._header is None:
+            idx = self._small_index(key)
+            del self._keys[idx]
+            del self._scores[idx]
+            del self._mapping[key]
+        else:
+            self._delete_item(self._mapping.pop(key))
+            self._maybe_to_small()
+
+    def _delete_item(self, item):
+        score = item.score
+        key_hash = hash(item.key)
         update = [None] * self._level
 
         x = self._header
         for i in range(self._level-1, -1, -1):
-            while x[i].forward and x[i].forward < item:
-                x = x[i].forward
+            next = x.pointers[i].forward
+            while next is not None and (next.score < score or
+                    next.score == score and hash(next.key) < key_hash):
+                x = next
+                next = x.pointers[i].forward
             update[i] = x
 
-        assert item == x[0].forward
+        assert item is x.pointers[0].forward
         self._delete_node(item, update)
 
     def _delete_node(self, x, update):
+        pointers = x.pointers
+        last = self._last
+        for i in range(len(pointers)):
+            if last[i] is x:
+                last[i] = update[i]
         for i in range(self._level):
-            if update[i][i].forward == x:
-                update[i][i].span += x[i].span - 1
-                update[i][i].forward = x[i].forward
+            ptr = update[i].pointers[i]
+            if ptr.forward is x:
+                ptr.span += pointers[i].span - 1
+                ptr.forward = pointers[i].forward
             else:
-                update[i][i].span -= 1
-            assert update[i][i].span > 0 or not update[i][i].forward, update
-        if x[0].forward:
-            x[0].forward.backward = x.backward
+                ptr.span -= 1
+            assert ptr.span > 0 or ptr.forward is None, update
+        next = pointers[0].forward
+        if next is not None:
+            next.backward = x.backward
         else:
             self._tail = x.backward
-        while self._level > 1 and not self._header[self._level-1].forward:
+        self._shrink_level()
+
+    def _shrink_level(self):
+        header = self._header.pointers
+        while self._level > 1 and header[self._level-1].forward is None:
             self._level -= 1
+        del self._last[self._level:]
+
+    def _tail_pointers(self):
+        """Returns update vector and ranks for the position past the tail
+
+        The last pointer at each level spans past the end of the list, so
+        ranks are known without a descent.
+        """
+        end = len(self._mapping) + 1
+        update = self._last[:]
+        rank = [end - node.pointers[i].span for i, node in enumerate(update)]
+        return update, rank
+
+    def _unlink_range(self, before, before_rank, last, last_rank,
+                      detach=False):
+        """Unlinks all items between two update vectors in bulk
+
+        The ``before`` are items preceding the range at each level, and
+        ``last`` are last items of the range at each level (or same items as
+        in ``before`` when there is no item of that level in the range).
+        Ranks are positions of these items, header being at zero, as returned
+        by ``_item_and_pointers_by_*``.
+
+        Returns number of removed items, or if ``detach`` is true, a new set
+        that is built of unlinked items without copying them.
+        """
+        start = before_rank[0]
+        count = last_rank[0] - start
+        if count <= 0:
+            return self.__class__() if detach else 0
+        if detach:
+            result = self.__class__()
+            result._to_skiplist()
+
+        tails = self._last
+        first = before[0].pointers[0].forward
+        next = last[0].pointers[0].forward
+        for i in range(self._level):
+            ptr = before[i].pointers[i]
+            end = last[i]
+            if end is before[i]:
+                ptr.span -= count
+                continue
+            eptr = end.pointers[i]
+            if detach:
+                if i > 0:
+                    result._header.pointers.append(Pointer())
+                    result._last.append(end)
+                    result._level = i + 1
+                else:
+                    result._last[0] = end
+                hptr = result._header.pointers[i]
+                hptr.forward = ptr.forward
+                hptr.span = before_rank[i] + ptr.span - start
+            ptr.forward = eptr.forward
+            ptr.span = last_rank[i] + eptr.span - before_rank[i] - count
+            if tails[i] is end:
+                tails[i] = before[i]
+            if detach:
+                eptr.forward = None
+                eptr.span = count + 1 - (last_rank[i] - start)
+
+        prev = None if before[0] is self._header else before[0]
+        if next is None:
+            self._tail = prev
+        else:
+            next.backward = prev
+        self._shrink_level()
+
+        mapping = self._mapping
+        item = first
+        if detach:
+            first.backward = None
+            result._tail = last[0]
+            removed = result._mapping
+            for i in range(count):
+                removed[item.key] = mapping.pop(item.key)
+                item = item.pointers[0].forward
+            result._maybe_to_small()
+            self._maybe_to_small()
+            self._changed_many('del', list(result))
+            return result
+        keys = [] if self._listeners else None
+        for i in range(count):
+            del mapping[item.key]
+            if keys is not None:
+                keys.append(item.key)
+            item.backward = None  # let refcounting free the unlinked chain
+            item = item.pointers[0].forward
+        self._maybe_to_small()
+        if keys is None:
+            self._seq += count
+        else:
+            self._changed_many('del', keys)
+        return count
 
     def index(self, key):
+        if self._header is None:
+            return self._small_index(key)
+        item = self._mapping[key]
+        score = item.score
+        key_hash = hash(key)
         x = self._header
         rank = -1  # first key is always a header (Empty key)
-        item = self._mapping[key]
         for i in range(self._level-1, -1, -1):
-            while x[i].forward and x[i].forward <= item:
-                rank += x[i].span
-                x = x[i].forward
-            if x.key == key:
+            ptr = x.pointers[i]
+            next = ptr.forward
+            while next is not None and (next.score < score or
+                    next.score == score and (next is item or
+                                             hash(next.key) < key_hash)):
+                rank += ptr.span
+                x = next
+                ptr = x.pointers[i]
+                next = ptr.forward
+            if x is item:
                 return rank
-        raise KeyError(key, score)
+        raise KeyError(key)
 
     def _item_by_index(self, rank):
         if rank < 0:
@@ -329,52 +804,375 @@ class SortedSet(MutableMapping):
         x = self._header
         traversed = -1  # first key is always a header (Empty key)
         for i in range(self._level-1, -1, -1):
-            while x[i].forward and x[i].span + traversed <= rank:
-                traversed += x[i].span
-                x = x[i].forward
+            ptr = x.pointers[i]
+            while ptr.forward is not None and ptr.span + traversed <= rank:
+                traversed += ptr.span
+                x = ptr.forward
+                ptr = x.pointers[i]
             if traversed == rank:
                 return x
         raise IndexError(rank)
 
     def _item_and_pointers_by_index(self, rank):
+        """Returns item at ``rank``
+
+        This one returns also ``update`` array and ranks of its items to
+        assist in item deletion
+        """
         if rank < 0:
             raise IndexError(rank)
         x = self._header
         update = [None] * self._level
-        traversed = -1  # first key is always a header (Empty key)
+        ranks = [0] * self._level
+        traversed = 0
         for i in range(self._level-1, -1, -1):
-            while x[i].forward and x[i].span + traversed < rank:
-                traversed += x[i].span
-                x = x[i].forward
+            ptr = x.pointers[i]
+            while ptr.forward is not None and traversed + ptr.span <= rank:
+                traversed += ptr.span
+                x = ptr.forward
+                ptr = x.pointers[i]
             update[i] = x
-        x = x[0].forward
-        return x, update
+            ranks[i] = traversed
+        return x.pointers[0].forward, update, ranks
 
     def _item_by_score_left_incl(self, score):
         """Returns left most item scored up to `score` inclusive"""
         # "left" name is analogy to bisect_left
         x = self._header
         for i in range(self._level-1, -1, -1):
-            while x[i].forward and x[i].forward.score < score:
-                x = x[i].forward
-        x = x[0].forward
-        return x
+            next = x.pointers[i].forward
+            while next is not None and next.score < score:
+                x = next
+                next = x.pointers[i].forward
+        return x.pointers[0].forward
 
     def _item_and_pointers_by_score_left_incl(self, score):
         """Returns left most item scored up to `score` inclusive
 
-        This one returns also ``update`` array to assist in item deletion
+        This one returns also ``update`` array and ranks of its items to
+        assist in item deletion
         """
         x = self._header
         update = [None] * self._level
+        rank = [0] * self._level
+        traversed = 0
         for i in range(self._level-1, -1, -1):
-            while x[i].forward and x[i].forward.score < score:
-                x = x[i].forward
+            ptr = x.pointers[i]
+            while ptr.forward is not None and ptr.forward.score < score:
+                traversed += ptr.span
+                x = ptr.forward
+                ptr = x.pointers[i]
             update[i] = x
-        x = x[0].forward
-        return x, update
+            rank[i] = traversed
+        return x.pointers[0].forward, update, rank
+
+    def random_members(self, k, rank_range=None, score_range=None,
+                       with_replacement=False, weighted=False):
+        """Returns ``k`` random keys in order of their ranks
+
+        Candidates may be limited by ``rank_range`` and ``score_range``, both
+        are ``(start, stop)`` pairs that work like slices of ``by_index`` and
+        ``by_score`` respectively.
+
+        With ``weighted`` keys are picked with probability proportional to
+        their scores (scores must not be negative). It requires
+        ``with_replacement``. Prefix sums of scores used for that are
+        computed once for every version of the set.
+        """
+        start, stop = 0, len(self)
+        if rank_range is not None:
+            start, stop, _ = slice(*rank_range).indices(len(self))
+        if score_range is not None:
+            low, high = score_range
+            if low is not None:
+                start = max(start, self._rank_by_score(low))
+            if high is not None:
+                stop = min(stop, self._rank_by_score(high))
+        if weighted:
+            if not with_replacement:
+                raise ValueError("Weighted sampling requires replacement")
+            sums = self._score_sums()
+            base = sums[start]
+            total = sums[max(start, stop)] - base
+            if k and not total > 0:
+                raise ValueError("No positive scores to sample from")
+            ranks = [bisect_right(sums, base + random.random()*total,
+                                  start, stop) - 1
+                     for i in range(k)]
+        elif with_replacement:
+            ranks = [random.randrange(start, stop) for i in range(k)]
+        else:
+            ranks = random.sample(range(start, stop), k)
+        ranks.sort()
+        if self._header is None:
+            return [self._keys[rank] for rank in ranks]
+        return [item.key for item in self._items_by_ranks(ranks)]
+
+    def _rank_by_score(self, score):
+        """Returns rank of the left most item scored ``score`` or more"""
+        if self._header is None:
+            return bisect_left(self._scores, score)
+        _, _, rank = self._item_and_pointers_by_score_left_incl(score)
+        return rank[0]
+
+    def _score_sums(self):
+        """Returns prefix sums of scores, first element is always zero"""
+        if self._weights is not None and self._weights[0] == self._seq:
+            return self._weights[1]
+        if self._header is None:
+            scores = self._scores
+        else:
+            scores = []
+            item = self._header.pointers[0].forward
+            while item is not None:
+                scores.append(item.score)
+                item = item.pointers[0].forward
+        if scores and min(scores) < 0:
+            raise ValueError("Can't use negative scores as weights")
+        sums = [0]
+        sums.extend(accumulate(scores))
+        self._weights = (self._seq, sums)
+        return sums
+
+    def _items_by_ranks(self, ranks):
+        """Returns items at ``ranks`` that must be sorted
+
+        Every search continues from the update vector of the previous one
+        and only climbs as many levels as needed to reach the next rank, so
+        the whole batch is a single pass over the skiplist.
+        """
+        level = self._level
+        update = [self._header] * level
+        position = [0] * level  # header is at zero
+        items = []
+        for rank in ranks:
+            target = rank + 1
+            top = 0
+            while top + 1 < level:
+                ptr = update[top+1].pointers[top+1]
+                if ptr.forward is None or position[top+1] + ptr.span > target:
+                    break
+                top += 1
+            x = update[top]
+            traversed = position[top]
+            for i in range(top, -1, -1):
+                if position[i] > traversed:
+                    x = update[i]
+                    traversed = position[i]
+                ptr = x.pointers[i]
+                while (ptr.forward is not None and
+                       traversed + ptr.span <= target):
+                    traversed += ptr.span
+                    x = ptr.forward
+                    ptr = x.pointers[i]
+                update[i] = x
+                position[i] = traversed
+            items.append(x)
+        return items
 
     def __repr__(self):
         return '<SortedSet {}>'.format(reprlib.Repr().repr_dict(self, 1))
 
 
+
+
+class SharedRankView:
+    __slots__ = ('_set',)
+
+    def __init__(self, set):
+        self._set = set
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self._set))
+            if step <= 0:
+                raise ValueError("Negative step is useless")
+            ranks = range(start, stop, step)
+            return SortedSet((self._set._key(i), self._set._scores[i])
+                             for i in ranks)
+        else:
+            if key < 0 or key >= len(self._set):
+                raise IndexError(key)
+            return self._set._key(key)
+
+
+class SharedScoreView:
+    __slots__ = ('_set',)
+
+    def __init__(self, set):
+        self._set = set
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step != None:
+                raise ValueError("Step must be None")
+            scores = self._set._scores
+            start = 0 if key.start is None else bisect_left(scores, key.start)
+            stop = (len(scores) if key.stop is None
+                    else bisect_left(scores, key.stop))
+            return SortedSet((self._set._key(i), scores[i])
+                             for i in range(start, stop))
+        else:
+            raise NotImplementedError('Only slicing by score supported')
+
+
+class SharedSortedSet(Mapping):
+    """Read-only sorted set in a memory-mapped file
+
+    The file is written by ``SharedSortedSet.publish(sortedset, path)`` and
+    may be opened by any number of processes. Lookups read packed arrays of
+    scores and keys right from the shared pages, so every process doesn't
+    need a copy of the whole set.
+
+    Publishing replaces the file atomically, readers keep the version they
+    opened until ``refresh()`` is called.
+
+    Keys must be strings, scores are stored as double precision floats.
+    """
+    __slots__ = ('_path', '_stat', '_mmap', '_buffers',
+                 '_scores', '_offsets', '_by_key', '_blob')
+
+    # magic, format version, number of items, size of keys blob
+    _header = struct.Struct('=4sIQQ')
+    _magic = b'SSET'
+    _version = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._mmap = None
+        self._open()
+
+    @classmethod
+    def publish(cls, sortedset, path):
+        """Writes ``sortedset`` to ``path`` for sharing between processes
+
+        File is written under a temporary name and then renamed, so readers
+        either see previous version or a new one, never a partial file.
+        """
+        keys = []
+        for key in sortedset:
+            if not isinstance(key, str):
+                raise TypeError("Only string keys can be shared, got {!r}"
+                                .format(key))
+            keys.append(key.encode('utf-8'))
+        scores = array('d', (sortedset[key] for key in sortedset))
+        offsets = array('Q', [0])
+        for key in keys:
+            offsets.append(offsets[-1] + len(key))
+        by_key = array('Q', sorted(range(len(keys)), key=keys.__getitem__))
+        blob = b''.join(keys)
+
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(cls._header.pack(cls._magic, cls._version,
+                                     len(keys), len(blob)))
+            f.write(scores)
+            f.write(offsets)
+            f.write(by_key)
+            f.write(blob)
+        os.replace(tmp, path)
+
+    def _open(self):
+        with open(self._path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, blob_size = self._header.unpack_from(mm)
+        if magic != self._magic or version != self._version:
+            mm.close()
+            raise ValueError("{!r} is not a sorted set file"
+                             .format(self._path))
+        view = memoryview(mm)
+        pos = self._header.size
+        scores = view[pos:pos + 8*size].cast('d')
+        pos += 8*size
+        offsets = view[pos:pos + 8*(size + 1)].cast('Q')
+        pos += 8*(size + 1)
+        by_key = view[pos:pos + 8*size].cast('Q')
+        pos += 8*size
+        blob = view[pos:pos + blob_size]
+
+        self.close()
+        self._stat = (stat.st_dev, stat.st_ino)
+        self._mmap = mm
+        self._buffers = (view, scores, offsets, by_key, blob)
+        self._scores = scores
+        self._offsets = offsets
+        self._by_key = by_key
+        self._blob = blob
+
+    def refresh(self):
+        """Switches to the latest published version of the set
+
+        Returns True if a new version was opened
+        """
+        stat = os.stat(self._path)
+        if (stat.st_dev, stat.st_ino) == self._stat:
+            return False
+        self._open()
+        return True
+
+    def close(self):
+        if self._mmap is not None:
+            # memory map can't be closed while there are views into it
+            for buf in reversed(self._buffers):
+                buf.release()
+            self._mmap.close()
+            self._mmap = None
+
+    @property
+    def by_index(self):
+        return SharedRankView(self)
+
+    @property
+    def by_score(self):
+        return SharedScoreView(self)
+
+    def _key(self, idx):
+        return str(self._blob[self._offsets[idx]:self._offsets[idx+1]],
+                   'utf-8')
+
+    def _find(self, key):
+        """Returns rank of the key or -1 if there is no such key"""
+        if not isinstance(key, str):
+            return -1
+        key = key.encode('utf-8')
+        blob = self._blob
+        offsets = self._offsets
+        by_key = self._by_key
+        lo = 0
+        hi = len(by_key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            idx = by_key[mid]
+            if bytes(blob[offsets[idx]:offsets[idx+1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(by_key):
+            idx = by_key[lo]
+            if blob[offsets[idx]:offsets[idx+1]] == key:
+                return idx
+        return -1
+
+    def __getitem__(self, key):
+        idx = self._find(key)
+        if idx < 0:
+            raise KeyError(key)
+        return self._scores[idx]
+
+    def __iter__(self):
+        for idx in range(len(self._scores)):
+            yield self._key(idx)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def index(self, key):
+        idx = self._find(key)
+        if idx < 0:
+            raise KeyError(key)
+        return idx
+
+    def __repr__(self):
+        return '<SharedSortedSet {}>'.format(
+            reprlib.Repr().repr_dict(self, 1))
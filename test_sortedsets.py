@@ -1,12 +1,14 @@
+import os
 import unittest
 import random
 import copy
+import tempfile
 import fractions
 from operator import itemgetter
 from itertools import combinations, product
 from unittest.mock import patch
 
-from sortedsets import SortedSet
+from sortedsets import SortedSet, SharedSortedSet, Change, SequenceGap
 
 
 class TestSortedSets(unittest.TestCase):
@@ -186,6 +188,156 @@ class TestSortedSets(unittest.TestCase):
             fractions.Fraction(4/3):fractions.Fraction(7/3)
             ], SortedSet({'two1': 2, 'two2': 2, 'two3': 2}))
 
+    def test_append(self):
+        ss = SortedSet()
+        for i in range(100):
+            ss['k{}'.format(i)] = i
+        ss['middle'] = 49.5
+        ss['k100'] = 100
+        keys = ['k{}'.format(i) for i in range(101)]
+        keys.insert(50, 'middle')
+        self.assertEqual(list(ss), keys)
+        self.assertEqual(list(reversed(ss)), keys[::-1])
+        for idx, key in enumerate(keys):
+            self.assertEqual(ss.index(key), idx)
+            self.assertEqual(ss.by_index[idx], key)
+
+    def test_trim_by_score(self):
+        items = [('k{}'.format(i), i) for i in range(100)]
+        ss = SortedSet(items)
+        del ss.by_score[:50]
+        self.assertEqual(list(ss.items()), items[50:])
+        del ss.by_score[:50]
+        self.assertEqual(list(ss.items()), items[50:])
+        del ss.by_score[:60.5]
+        self.assertEqual(list(ss.items()), items[61:])
+        ss['k100'] = 100
+        self.assertEqual(list(ss.items()), items[61:] + [('k100', 100)])
+        for idx, (key, score) in enumerate(items[61:]):
+            self.assertEqual(ss.index(key), idx)
+            self.assertEqual(ss.by_index[idx], key)
+        del ss.by_score[:]
+        self.assertEqual(ss, SortedSet())
+        self.assertEqual(list(reversed(ss)), [])
+        ss.update(items)
+        self.assertEqual(list(ss.items()), items)
+
+    def test_remove_range(self):
+        items = [('k{}'.format(i), i) for i in range(100)]
+        ss = SortedSet(items)
+        self.assertEqual(ss.by_index.remove(10, 20), 10)
+        self.assertEqual(ss.by_score.remove(50, 60), 10)
+        self.assertEqual(ss.by_score.remove(50, 60), 0)
+        self.assertEqual(ss.by_index.remove(-10), 10)
+        left = items[:10] + items[20:50] + items[60:90]
+        self.assertEqual(list(ss.items()), left)
+        for idx, (key, score) in enumerate(left):
+            self.assertEqual(ss.index(key), idx)
+        del ss.by_index[0]
+        self.assertEqual(list(ss.items()), left[1:])
+        with self.assertRaises(IndexError):
+            del ss.by_index[len(ss)]
+
+    def test_pop_range(self):
+        items = [('k{}'.format(i), i) for i in range(100)]
+        ss = SortedSet(items)
+        popped = ss.by_index.pop(10, 20)
+        self.assertEqual(list(popped.items()), items[10:20])
+        self.assertEqual(list(ss.items()), items[:10] + items[20:])
+        popped = ss.by_score.pop(None, 5)
+        self.assertEqual(list(popped.items()), items[:5])
+        self.assertEqual(list(reversed(popped)), [k for k, v in items[4::-1]])
+        popped['k100'] = 100
+        del popped['k0']
+        self.assertEqual(list(popped.items()), items[1:5] + [('k100', 100)])
+        self.assertEqual(popped.by_index[len(popped) - 1], 'k100')
+        self.assertEqual(ss.by_score.pop(200), SortedSet())
+        popped = ss.by_score.pop()
+        self.assertEqual(list(popped.items()), items[5:10] + items[20:])
+        self.assertEqual(ss, SortedSet())
+
+    def test_copy(self):
+        items = [('k{}'.format(i), i) for i in range(200)]
+        ss = SortedSet(items)
+        for copied in (ss.copy(), ss.snapshot(), copy.copy(ss)):
+            self.assertEqual(list(copied.items()), items)
+            self.assertEqual(list(reversed(copied)),
+                             [k for k, v in reversed(items)])
+            for idx, (key, score) in enumerate(items):
+                self.assertEqual(copied.index(key), idx)
+                self.assertEqual(copied.by_index[idx], key)
+        snap = ss.snapshot()
+        ss['k0'] = 1000
+        del ss.by_index[10:20]
+        ss['new'] = 0.5
+        self.assertEqual(list(snap.items()), items)
+        snap['k10'] = -1
+        self.assertEqual(ss.index('k21'), 11)
+        self.assertEqual(snap.index('k10'), 0)
+
+    def test_changes(self):
+        ss = SortedSet({'one': 1, 'two': 2, 'three': 3, 'four': 4})
+        replica = ss.snapshot()
+        changes = []
+        ss.subscribe(changes.append)
+        ss['five'] = 5
+        ss['one'] = 6
+        del ss['two']
+        del ss.by_score[3:5]
+        seq = replica.sequence
+        self.assertEqual(changes, [
+            Change(seq + 1, 'set', 'five', 5),
+            Change(seq + 2, 'set', 'one', 6),
+            Change(seq + 3, 'del', 'two', None),
+            Change(seq + 4, 'del', 'three', None),
+            Change(seq + 5, 'del', 'four', None),
+            ])
+        self.assertEqual(ss.sequence, seq + 5)
+        with self.assertRaises(SequenceGap):
+            replica.apply_changes(changes[1:])
+        replica.apply_changes(changes[:3])
+        replica.apply_changes(changes)
+        self.assertEqual(list(replica.items()), [('five', 5), ('one', 6)])
+        self.assertEqual(replica.sequence, ss.sequence)
+        ss.unsubscribe(changes.append)
+        ss['seven'] = 7
+        self.assertEqual(len(changes), 5)
+
+    def test_random_members(self):
+        items = [('k{}'.format(i), i % 10) for i in range(200)]
+        ss = SortedSet(items)
+        keys = list(ss)
+        sample = ss.random_members(50)
+        self.assertEqual(len(set(sample)), 50)
+        self.assertEqual(sample, sorted(sample, key=ss.index))
+        sample = ss.random_members(10, rank_range=(-10, None))
+        self.assertEqual(sorted(sample), sorted(keys[-10:]))
+        sample = ss.random_members(40, score_range=(3, 5))
+        self.assertEqual(sorted(sample), sorted(ss.by_score[3:5]))
+        sample = ss.random_members(30, rank_range=(0, 180),
+                                   score_range=(8, None),
+                                   with_replacement=True)
+        self.assertEqual(len(sample), 30)
+        self.assertEqual(set(sample) - set(ss.by_score[8:9]), set())
+        with self.assertRaises(ValueError):
+            ss.random_members(21, score_range=(3, 4))
+        sample = ss.random_members(100, score_range=(None, 2), weighted=True,
+                                   with_replacement=True)
+        self.assertEqual({ss[key] for key in sample}, {1})
+        with self.assertRaises(ValueError):
+            ss.random_members(1, score_range=(None, 1), weighted=True,
+                              with_replacement=True)
+        with self.assertRaises(ValueError):
+            ss.random_members(1, weighted=True)
+        ss['k1'] = 0
+        ss['k3'] = 3000
+        sample = ss.random_members(100, score_range=(None, 2), weighted=True,
+                                   with_replacement=True)
+        self.assertNotIn('k1', sample)
+        ss['k1'] = -1
+        with self.assertRaises(ValueError):
+            ss.random_members(1, weighted=True, with_replacement=True)
+
     def test_delete_all_cases(self):
         for levels in product(range(1, 4), range(1, 4), range(1, 4)):
             # delete middle
@@ -232,6 +384,89 @@ class TestSortedSets(unittest.TestCase):
             self.assertEqual(list(ss), [])
 
 
+class TestSmallSets(unittest.TestCase):
+
+    def test_small_encoding(self):
+        items = [('k{}'.format(i), i) for i in range(200)]
+        ss = SortedSet()
+        for key, score in items:
+            ss[key] = score
+            self.assertEqual(ss._header is None,
+                             len(ss) <= SortedSet.small_size)
+        self.assertEqual(list(ss.items()), items)
+        ss['k0'] = 1000
+        self.assertEqual(ss.index('k0'), 199)
+        del ss.by_index[SortedSet.small_size // 2:]
+        self.assertIsNotNone(ss._header)
+        del ss.by_index[len(ss) - 1]
+        self.assertIsNone(ss._header)
+        self.assertEqual(list(ss.items()),
+                         items[1:SortedSet.small_size // 2])
+        popped = SortedSet(items).by_score.pop(10, 20)
+        self.assertIsNone(popped._header)
+        self.assertEqual(list(popped.items()), items[10:20])
+
+
+class TestShared(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'set')
+
+    def test_lookups(self):
+        ss = SortedSet(('k{}'.format(i), i % 7) for i in range(200))
+        ss['\u043a\u043b\u044e\u0447'] = 2.5
+        SharedSortedSet.publish(ss, self.path)
+        shared = SharedSortedSet(self.path)
+        self.addCleanup(shared.close)
+        self.assertEqual(len(shared), len(ss))
+        self.assertEqual(list(shared), list(ss))
+        for idx, key in enumerate(ss):
+            self.assertEqual(shared[key], ss[key])
+            self.assertEqual(shared.index(key), idx)
+            self.assertEqual(shared.by_index[idx], key)
+        self.assertNotIn('k200', shared)
+        self.assertNotIn(1, shared)
+        with self.assertRaises(KeyError):
+            shared.index('k200')
+        with self.assertRaises(IndexError):
+            shared.by_index[len(ss)]
+        self.assertEqual(shared.by_index[10:50:3], ss.by_index[10:50:3])
+        self.assertEqual(shared.by_score[2:4], ss.by_score[2:4])
+        self.assertEqual(shared.by_score[2.5:], ss.by_score[2.5:])
+        self.assertEqual(shared.by_score[:], ss)
+
+    def test_publish(self):
+        SharedSortedSet.publish(SortedSet({'one': 1, 'two': 2}), self.path)
+        shared = SharedSortedSet(self.path)
+        self.addCleanup(shared.close)
+        self.assertFalse(shared.refresh())
+        SharedSortedSet.publish(SortedSet({'three': 3}), self.path)
+        self.assertEqual(dict(shared), {'one': 1, 'two': 2})
+        self.assertTrue(shared.refresh())
+        self.assertEqual(dict(shared), {'three': 3})
+        SharedSortedSet.publish(SortedSet(), self.path)
+        self.assertTrue(shared.refresh())
+        self.assertEqual(list(shared), [])
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['set'])
+        with self.assertRaises(TypeError):
+            SharedSortedSet.publish(SortedSet({1: 1}), self.path)
+
+
+class SkiplistMixin:
+    """Runs tests with small sets stored as skiplist too"""
+
+    def setUp(self):
+        patcher = patch.object(SortedSet, 'small_size', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestSkiplist(SkiplistMixin, TestSortedSets):
+    pass
+
+
 class TestFuzzy(unittest.TestCase):
 
     def test_insert_integers(self):
@@ -398,5 +633,9 @@ class TestFuzzy(unittest.TestCase):
                     self.assertEqual(cur.by_index[idx], key)
 
 
+class TestSkiplistFuzzy(SkiplistMixin, TestFuzzy):
+    pass
+
+
 if __name__ == '__main__':
     unittest.main()